@@ -0,0 +1,70 @@
+"""
+Compares memory per job and `new_job` throughput of the job registry with
+the previous implementation (`(job_type_id, job)` tuples and `uuid1` IDs
+checked for collisions).
+
+    python benchmarks/bench_new_job.py [number_of_jobs]
+"""
+import asyncio
+import gc
+import sys
+import time
+import tracemalloc
+import uuid
+
+from rooman.core import Job, RoomanBase
+
+
+class Rooman(RoomanBase):
+    async def do_create_job(self, job_type_id, new_job_free_parameter):
+        return Job()
+
+
+class LegacyRooman(Rooman):
+    async def new_job(self, job_type_id, new_job_free_parameter):
+        job = await self.do_create_job(job_type_id, new_job_free_parameter)
+
+        while True:
+            new_job_id = str(uuid.uuid1())
+            if new_job_id not in self.jobs:
+                break
+
+        self.jobs[new_job_id] = (job_type_id, job)
+        return new_job_id
+
+
+async def fill(rooman, count):
+    for i in range(count):
+        # A fresh `str` per job, as job type IDs decoded from requests are.
+        await rooman.new_job(''.join(['type', str(i % 10)]), None)
+
+
+def measure_memory(cls, count):
+    rooman = cls()
+    gc.collect()
+    tracemalloc.start()
+    asyncio.run(fill(rooman, count))
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size / count
+
+
+def measure_throughput(cls, count):
+    rooman = cls()
+    start = time.perf_counter()
+    asyncio.run(fill(rooman, count))
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    for name, cls in (('legacy', LegacyRooman), ('current', Rooman)):
+        memory = measure_memory(cls, count)
+        throughput = measure_throughput(cls, count)
+        print('{:8} {:8.1f} bytes/job {:10.0f} new_job/s'.format(
+            name, memory, throughput))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,15 @@
 import asyncio
-import uuid
+import secrets
+import sys
+import time
 
 from . import errors
+from . import tracing
+from .introspection import JobIntrospector
+from .job_id import JobIDAllocator, MonotonicJobIDAllocator, UUIDJobIDAllocator
+from .policy import DebouncePolicy, JobActionPolicy, ThrottlePolicy
+from .scene import Scene, SceneStep
+from .scheduler import Scheduler
 
 
 class Job:
@@ -12,9 +20,61 @@ class Job:
         pass
 
 
+class JobRecord:
+    """
+    An entry of `RoomanBase.jobs`. Times are from `time.time()`.
+    """
+    __slots__ = ('job_type_id', 'job', 'created_at', 'last_used')
+
+    def __init__(self, job_type_id, job, created_at=None):
+        if type(job_type_id) is str:
+            # Many jobs share few type IDs; keep one string per type.
+            job_type_id = sys.intern(job_type_id)
+        if created_at is None:
+            created_at = time.time()
+        self.job_type_id = job_type_id
+        self.job = job
+        self.created_at = created_at
+        self.last_used = created_at
+
+    # Job records used to be `(job_type_id, job)` tuples. Keep code which
+    # indexes or unpacks them working.
+    def __iter__(self):
+        return iter((self.job_type_id, self.job))
+
+    def __getitem__(self, index):
+        return (self.job_type_id, self.job)[index]
+
+
 class RoomanBase:
-    def __init__(self):
+    def __init__(self, job_id_allocator=None):
+        # job_id -> JobRecord
         self.jobs = {}
+        if job_id_allocator is None:
+            job_id_allocator = MonotonicJobIDAllocator()
+        self.job_id_allocator = job_id_allocator
+        # Bumped on every change to `self.jobs`. `job_type_versions` holds the
+        # value of `jobs_version` at the last change of each job type, so
+        # versions are unique across types too.
+        self.jobs_version = 0
+        self.job_type_versions = {}
+        self._jobs_epoch = secrets.token_hex(4)
+        self.scenes = {}
+        # job_type_id -> JobActionPolicy
+        self.job_action_policies = {}
+        self.job_introspector = JobIntrospector()
+        self.scheduler = Scheduler()
+        # Disabled until a sink is set. User code can open child spans with
+        # `self.tracer.span(name)`.
+        self.tracer = tracing.Tracer()
+
+    async def close(self):
+        """
+        Stops scheduled runs and exports the remaining spans. Call this when
+        shutting down, on the event loop the instance was used on.
+        """
+        await self.scheduler.close()
+        await self.tracer.close()
 
     async def do_action(self, action_id, action_free_parameter):
         raise NotImplementedError()
@@ -23,38 +83,125 @@ class RoomanBase:
         raise NotImplementedError()
 
     async def invoke_action(self, action_id, action_free_parameter):
-        return await self.do_action(action_id, action_free_parameter)
+        with self.tracer.span('do_action') as span:
+            span.set_attribute('action_id', action_id)
+            return await self.do_action(action_id, action_free_parameter)
 
     async def new_job(self, job_type_id, new_job_free_parameter):
         job = await self.do_create_job(job_type_id, new_job_free_parameter)
-            
-        while True:
-            new_job_id = str(uuid.uuid1())
-            if new_job_id not in self.jobs:
-                break
 
-        self.jobs[new_job_id] = (job_type_id, job)
+        new_job_id = self.job_id_allocator.allocate()
+        record = JobRecord(job_type_id, job)
+        self.jobs[new_job_id] = record
+        self._bump_jobs_version(record.job_type_id)
         return new_job_id
 
     async def delete_job(self, job_id):
-        job = self.jobs.get(job_id)
-        if job is None:
+        record = self.jobs.get(job_id)
+        if record is None:
             raise errors.JobIDNotFoundError(job_id)
 
-        await job[1].on_delete()
+        await record.job.on_delete()
 
         del self.jobs[job_id]
+        self._bump_jobs_version(record.job_type_id)
+        self.scheduler.cancel_job(job_id)
+        policy = self.job_action_policies.get(record.job_type_id)
+        if policy is not None:
+            policy.forget(job_id)
+
+    def _bump_jobs_version(self, job_type_id):
+        self.jobs_version += 1
+        self.job_type_versions[job_type_id] = self.jobs_version
+
+    def get_job_list_version(self, job_type_id):
+        """
+        Returns a string identifying the current result of
+        `list_job(job_type_id)`. It changes whenever that result may change
+        and differs between instances (and therefore process restarts).
+        """
+        if job_type_id is None:
+            version = self.jobs_version
+        else:
+            version = self.job_type_versions.get(job_type_id, 0)
+        return '{}-{}'.format(self._jobs_epoch, version)
 
     async def list_job(self, job_type_id):
-        ret = ((job_id, job_type_id) for job_id, (job_type_id, _) in self.jobs.items())
+        ret = ((job_id, record.job_type_id)
+               for job_id, record in self.jobs.items())
         if job_type_id is not None:
             ret = (x for x in ret if x[1] == job_type_id)
         return [{'job_id': x[0], 'job_type_id': x[1]} for x in ret]
 
     async def invoke_job_action(self, job_id, job_action_free_parameter):
-        job = self.jobs.get(job_id)
-        if job is None:
+        record = self.jobs.get(job_id)
+        if record is None:
+            raise errors.JobIDNotFoundError(job_id)
+
+        async def call():
+            # A policy may have delayed the call; the job may be gone by now.
+            if self.jobs.get(job_id) is not record:
+                raise errors.JobIDNotFoundError(job_id)
+            record.last_used = time.time()
+            with self.tracer.span('on_action') as span:
+                span.set_attribute('job_id', job_id)
+                span.set_attribute('job_type_id', record.job_type_id)
+                return await record.job.on_action(job_action_free_parameter)
+
+        policy = self.job_action_policies.get(record.job_type_id)
+        if policy is None:
+            return await call()
+        return await policy.invoke(job_id, call)
+
+    def set_job_action_policy(self, job_type_id, policy):
+        """
+        Sets the `JobActionPolicy` (e.g. `DebouncePolicy` or
+        `ThrottlePolicy`) applied to job actions of jobs of `job_type_id`.
+        `None` removes it.
+        """
+        if policy is None:
+            self.job_action_policies.pop(job_type_id, None)
+        else:
+            self.job_action_policies[job_type_id] = policy
+
+    async def introspect_jobs(self, top=10, tracemalloc_diff=None):
+        return await self.job_introspector.report(self, top, tracemalloc_diff)
+
+    def register_scene(self, scene_id, steps, stop_on_failure=False):
+        """
+        `steps` is an iterable of `SceneStep`. Raises `ValueError` if the
+        steps do not form a valid dependency graph.
+        """
+        self.scenes[scene_id] = Scene(scene_id, steps, stop_on_failure)
+
+    def unregister_scene(self, scene_id):
+        if self.scenes.pop(scene_id, None) is None:
+            raise errors.SceneIDNotFoundError(scene_id)
+
+    async def invoke_scene(self, scene_id):
+        scene = self.scenes.get(scene_id)
+        if scene is None:
+            raise errors.SceneIDNotFoundError(scene_id)
+        return await scene.run(self)
+
+    async def schedule_action(self, action_id, action_free_parameter,
+                              delay=0, interval=None, jitter=0):
+        return self.scheduler.add(
+            lambda: self.invoke_action(action_id, action_free_parameter),
+            {'action_id': action_id}, delay, interval, jitter)
+
+    async def schedule_job_action(self, job_id, job_action_free_parameter,
+                                  delay=0, interval=None, jitter=0):
+        # Schedules are only cancelled by deleting their job, so one for an
+        # unknown job would fail forever.
+        if job_id not in self.jobs:
             raise errors.JobIDNotFoundError(job_id)
+        return self.scheduler.add(
+            lambda: self.invoke_job_action(job_id, job_action_free_parameter),
+            {'job_id': job_id}, delay, interval, jitter, job_id)
+
+    async def list_schedule(self):
+        return self.scheduler.list()
 
-        response = await job[1].on_action(job_action_free_parameter)
-        return response
+    async def cancel_schedule(self, schedule_id):
+        self.scheduler.cancel(schedule_id)
@@ -20,6 +20,31 @@ class JobIDNotFoundError(RoomanError):
         self.target = job_id
 
 
+class ScheduleIDNotFoundError(RoomanError):
+    def __init__(self, schedule_id):
+        super().__init__(schedule_id)
+        self.target = schedule_id
+
+
+class SceneIDNotFoundError(RoomanError):
+    def __init__(self, scene_id):
+        super().__init__(scene_id)
+        self.target = scene_id
+
+
+class SupersededError(RoomanError):
+    def __init__(self, job_id):
+        super().__init__(job_id)
+        self.target = job_id
+
+
+class ThrottledError(RoomanError):
+    def __init__(self, job_id, retry_after):
+        super().__init__(job_id, retry_after)
+        self.target = job_id
+        self.retry_after = retry_after
+
+
 class FreeParameterError(RoomanError):
     def __init__(self, error_cases):
         super().__init__(error_cases)
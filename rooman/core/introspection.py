@@ -0,0 +1,264 @@
+import asyncio
+import heapq
+import itertools
+import math
+import random
+import sys
+import tracemalloc
+import types
+
+
+# Shared objects which should never be attributed to a single job.
+_opaque_types = (type, types.ModuleType, types.FunctionType,
+                 types.BuiltinFunctionType, types.MethodType, types.CodeType)
+
+
+def approximate_size(obj, exclude=(), max_depth=4, max_items=64):
+    """
+    Approximates the memory retained by `obj`: its own size plus the size of
+    the objects it refers to through attributes and containers, each counted
+    once. Objects in `exclude` (and everything only reachable through them)
+    are not counted. To bound the cost, references are followed at most
+    `max_depth` levels deep and only `max_items` elements of a container
+    are visited; the size of the rest is extrapolated from them.
+    """
+    seen = {id(x) for x in exclude}
+
+    def size(o, depth):
+        if id(o) in seen or isinstance(o, _opaque_types):
+            return 0
+        seen.add(id(o))
+        total = sys.getsizeof(o, 0)
+        if depth >= max_depth:
+            return total
+
+        if isinstance(o, dict):
+            items = o.items()
+            children = itertools.chain.from_iterable(
+                itertools.islice(items, max_items))
+            length = len(o)
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            children = itertools.islice(o, max_items)
+            length = len(o)
+        else:
+            children = []
+            length = 0
+            d = getattr(o, '__dict__', None)
+            if isinstance(d, dict):
+                children.append(d)
+            for cls in type(o).__mro__:
+                slots = getattr(cls, '__slots__', ())
+                if isinstance(slots, str):
+                    slots = (slots,)
+                for name in slots:
+                    try:
+                        children.append(getattr(o, name))
+                    except AttributeError:
+                        pass
+
+        child_size = sum(size(x, depth + 1) for x in children)
+        if length > max_items:
+            child_size = child_size * length // max_items
+        return total + child_size
+
+    return size(obj, 0)
+
+
+def _shallow_size(obj):
+    """
+    Cheap estimate of `approximate_size(obj)` for ranking: the size of `obj`
+    and of its attributes, without following them any further. Unlike
+    `approximate_size`, shared objects are not skipped.
+    """
+    total = sys.getsizeof(obj, 0)
+    d = getattr(obj, '__dict__', None)
+    if type(d) is dict:
+        total += sys.getsizeof(d, 0) + sum(map(sys.getsizeof, d.values()))
+    return total
+
+
+class _Reservoir:
+    """
+    Uniform sample of up to `size` items of a stream (Algorithm L). Once the
+    sample is full, random numbers are only drawn for the items that are
+    taken, not for every item.
+    """
+    __slots__ = ('size', 'count', 'sample', '_weight', '_next')
+
+    def __init__(self, size):
+        self.size = size
+        self.count = 0
+        self.sample = []
+        self._weight = 1.0
+        self._next = size
+
+    def add(self, item):
+        self.count += 1
+        if self.count <= self.size:
+            self.sample.append(item)
+            if self.count == self.size:
+                self._advance()
+        elif self.count == self._next:
+            self.sample[random.randrange(self.size)] = item
+            self._advance()
+
+    def _advance(self):
+        self._weight *= math.exp(math.log(1.0 - random.random()) / self.size)
+        skip = math.log(1.0 - random.random()) / math.log1p(-self._weight)
+        self._next += int(skip) + 1
+
+
+class JobIntrospector:
+    """
+    Reports the approximate memory held by the jobs of a `RoomanBase`.
+
+    Only up to `sample_size` jobs per job type are sized, and the total of
+    each type is extrapolated from them, so the number of jobs only adds a
+    cheap counting pass to the cost of a report. That pass also ranks every
+    job by the size of its attributes (see `_shallow_size`), and the `top`
+    jobs by that measure are sized as well, so a single large job shows up
+    in `largest_jobs` however many jobs there are. A job whose size lies
+    deeper than its attributes is only ranked correctly if it is sampled.
+
+    `tracemalloc` slows down every allocation, so when it is started by
+    `tracemalloc_diff` it is stopped again after `tracemalloc_window`
+    seconds without another diff, or by `stop_tracemalloc`.
+    """
+    # Number of jobs counted between yields to the event loop.
+    chunk_size = 10000
+
+    def __init__(self, sample_size=100, max_depth=4, max_items=64,
+                 tracemalloc_window=300):
+        self.sample_size = sample_size
+        self.max_depth = max_depth
+        self.max_items = max_items
+        self.tracemalloc_window = tracemalloc_window
+        self._snapshot = None
+        self._started_tracemalloc = False
+        self._stop_handle = None
+
+    async def report(self, rooman, top=10, tracemalloc_diff=None):
+        """
+        With `tracemalloc_diff` true, the report includes
+        `tracemalloc_diff(top)`; with false, `tracemalloc` is stopped.
+        """
+        if top < 0:
+            raise ValueError('top must not be negative')
+        reservoirs = {}
+        # Min-heap of the `top` largest jobs by `_shallow_size`.
+        candidates = []
+        # Iterate over a copy of the keys so the registry may change while
+        # the loop runs other tasks between chunks. Unlike copying the items,
+        # it allocates no new objects per job, which would trigger a long
+        # garbage collection with a large registry.
+        jobs = rooman.jobs
+        job_ids = list(jobs)
+        for start in range(0, len(job_ids), self.chunk_size):
+            if start:
+                await asyncio.sleep(0)
+            for job_id in job_ids[start:start + self.chunk_size]:
+                record = jobs.get(job_id)
+                if record is None:
+                    continue
+                reservoir = reservoirs.get(record.job_type_id)
+                if reservoir is None:
+                    reservoir = reservoirs[record.job_type_id] = _Reservoir(
+                        self.sample_size)
+                reservoir.add((job_id, record.job))
+                if top:
+                    job_size = _shallow_size(record.job)
+                    if len(candidates) < top:
+                        heapq.heappush(candidates, (
+                            job_size, job_id, record.job_type_id, record.job))
+                    elif job_size > candidates[0][0]:
+                        heapq.heapreplace(candidates, (
+                            job_size, job_id, record.job_type_id, record.job))
+        del job_ids
+
+        exclude = (rooman, rooman.jobs)
+        job_types = {}
+        # job_id -> (approximate size, job type ID)
+        sized = {}
+        for job_type_id, reservoir in reservoirs.items():
+            sample = reservoir.sample
+            total = 0
+            for job_id, job in sample:
+                job_size = approximate_size(job, exclude, self.max_depth,
+                                            self.max_items)
+                total += job_size
+                sized[job_id] = (job_size, job_type_id)
+            count = reservoir.count
+            job_types[job_type_id] = {
+                'count': count,
+                'sampled': len(sample),
+                'approximate_size': total * count // len(sample),
+            }
+
+        for _, job_id, job_type_id, job in candidates:
+            if job_id not in sized:
+                sized[job_id] = (
+                    approximate_size(job, exclude, self.max_depth,
+                                     self.max_items),
+                    job_type_id)
+
+        ret = {
+            'job_count': len(rooman.jobs),
+            'job_types': job_types,
+            'largest_jobs': [
+                {'job_id': job_id, 'job_type_id': job_type_id,
+                 'approximate_size': job_size}
+                for job_id, (job_size, job_type_id) in heapq.nlargest(
+                    top, sized.items(), key=lambda x: x[1][0])],
+        }
+        if tracemalloc_diff:
+            ret['tracemalloc'] = await self.tracemalloc_diff(top)
+        elif tracemalloc_diff is not None:
+            self.stop_tracemalloc()
+        return ret
+
+    async def tracemalloc_diff(self, top=10):
+        """
+        Takes a `tracemalloc` snapshot and returns the `top` allocation sites
+        that grew most since the previous call. The first call starts
+        `tracemalloc` if needed and returns an empty list.
+        """
+        if top < 0:
+            raise ValueError('top must not be negative')
+        loop = asyncio.get_running_loop()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+            self._snapshot = None
+        if self._started_tracemalloc:
+            if self._stop_handle is not None:
+                self._stop_handle.cancel()
+            self._stop_handle = loop.call_later(self.tracemalloc_window,
+                                                self.stop_tracemalloc)
+
+        snapshot = await loop.run_in_executor(None, tracemalloc.take_snapshot)
+        previous, self._snapshot = self._snapshot, snapshot
+        if previous is None:
+            return []
+
+        stats = await loop.run_in_executor(
+            None, snapshot.compare_to, previous, 'lineno')
+        return [{
+            'location': str(stat.traceback),
+            'size': stat.size,
+            'size_diff': stat.size_diff,
+            'count': stat.count,
+            'count_diff': stat.count_diff,
+        } for stat in stats[:top]]
+
+    def stop_tracemalloc(self):
+        """
+        Stops `tracemalloc` if `tracemalloc_diff` started it, and discards
+        the previous snapshot.
+        """
+        self._snapshot = None
+        if self._stop_handle is not None:
+            self._stop_handle.cancel()
+            self._stop_handle = None
+        if self._started_tracemalloc:
+            self._started_tracemalloc = False
+            tracemalloc.stop()
@@ -0,0 +1,42 @@
+import itertools
+import secrets
+import uuid
+
+
+class JobIDAllocator:
+    def allocate(self):
+        """
+        Returns a new job ID as `str`. It must not be returned again by this
+        allocator.
+        """
+        raise NotImplementedError()
+
+
+class MonotonicJobIDAllocator(JobIDAllocator):
+    """
+    Allocates IDs made of a random per-allocator prefix followed by a
+    counter, e.g. `'q3Xr_9aB11f'`. IDs are unique without checking the
+    registry, and the prefix keeps IDs from an earlier process from being
+    handed out again after a restart. All characters are URL-safe.
+
+    The counter is written in hexadecimal preceded by one hexadecimal digit
+    holding its length minus one, so IDs from the same allocator sort in
+    allocation order as strings (`'...0f'` < `'...110'`).
+    """
+    def __init__(self, prefix=None):
+        if prefix is None:
+            prefix = secrets.token_urlsafe(6)
+        self.prefix = prefix
+        self._counter = itertools.count(1)
+
+    def allocate(self):
+        digits = '{:x}'.format(next(self._counter))
+        return '{}{:x}{}'.format(self.prefix, len(digits) - 1, digits)
+
+
+class UUIDJobIDAllocator(JobIDAllocator):
+    """
+    Allocates time-based UUIDs, as job IDs were before allocators existed.
+    """
+    def allocate(self):
+        return str(uuid.uuid1())
@@ -0,0 +1,138 @@
+import asyncio
+import collections
+
+from . import errors
+
+
+class JobActionPolicy:
+    """
+    Decides how job actions of a job type reach `Job.on_action`. Set with
+    `RoomanBase.set_job_action_policy`. State is kept per job.
+    """
+    async def invoke(self, job_id, call):
+        """
+        `call` is a coroutine function which performs the job action.
+        """
+        return await call()
+
+    def forget(self, job_id):
+        """
+        Called when the job is deleted.
+        """
+        pass
+
+
+class _DebounceState:
+    def __init__(self):
+        self.generation = 0
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+
+class DebouncePolicy(JobActionPolicy):
+    """
+    Latest-wins debounce. A job action waits `delay` seconds before it is
+    performed; if another action for the same job arrives meanwhile, the
+    waiting one raises `SupersededError` without reaching the job. Actions
+    of a job are never performed concurrently, and one waiting for the
+    previous one to finish can still be superseded.
+    """
+    def __init__(self, delay):
+        self.delay = delay
+        self._states = {}
+
+    async def invoke(self, job_id, call):
+        state = self._states.get(job_id)
+        if state is None:
+            state = self._states[job_id] = _DebounceState()
+        state.generation += 1
+        generation = state.generation
+        state.users += 1
+        try:
+            await asyncio.sleep(self.delay)
+            self._check_current(job_id, state, generation)
+            async with state.lock:
+                self._check_current(job_id, state, generation)
+                return await call()
+        finally:
+            state.users -= 1
+            if state.users == 0 and self._states.get(job_id) is state:
+                del self._states[job_id]
+
+    def _check_current(self, job_id, state, generation):
+        if self._states.get(job_id) is not state:
+            # Forgotten, i.e. the job was deleted.
+            raise errors.JobIDNotFoundError(job_id)
+        if state.generation != generation:
+            raise errors.SupersededError(job_id)
+
+    def forget(self, job_id):
+        state = self._states.pop(job_id, None)
+        if state is not None:
+            # Makes waiting calls give up instead of acting on the deleted job.
+            state.generation += 1
+
+
+class ThrottlePolicy(JobActionPolicy):
+    """
+    Performs at most `max_calls` job actions per job in any `interval`
+    seconds. Actions over the limit wait for their turn, or raise
+    `ThrottledError` if `reject` is true.
+    """
+    def __init__(self, max_calls, interval, reject=False):
+        if max_calls < 1:
+            raise ValueError('max_calls must be positive')
+        self.max_calls = max_calls
+        self.interval = interval
+        self.reject = reject
+        # job_id -> start times, in order, of actions started within the
+        # last `interval` seconds and reserved times of waiting ones.
+        self._windows = {}
+        # job_id -> future done once the latest caller may perform its
+        # action. Each caller waits for its predecessor's, so waiters whose
+        # sleeps end at the same time still go in arrival order.
+        self._turns = {}
+
+    async def invoke(self, job_id, call):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        window = self._windows.get(job_id)
+        if window is None:
+            window = self._windows[job_id] = collections.deque()
+        while window and window[0] + self.interval <= now:
+            window.popleft()
+
+        start = now
+        if len(window) >= self.max_calls:
+            start = max(now, window[-self.max_calls] + self.interval)
+        if start > now and self.reject:
+            raise errors.ThrottledError(job_id, start - now)
+        window.append(start)
+
+        previous = self._turns.get(job_id)
+        turn = self._turns[job_id] = loop.create_future()
+        try:
+            if start > now:
+                await asyncio.sleep(start - now)
+            if previous is not None and not previous.done():
+                await asyncio.shield(previous)
+        except asyncio.CancelledError:
+            # Give the reserved slot back to later callers, and only let the
+            # next caller go once the previous one did.
+            try:
+                window.remove(start)
+            except ValueError:
+                pass
+            if previous is None or previous.done():
+                turn.set_result(None)
+            else:
+                previous.add_done_callback(lambda _: turn.set_result(None))
+            raise
+        turn.set_result(None)
+        if self._turns.get(job_id) is turn:
+            del self._turns[job_id]
+        return await call()
+
+    def forget(self, job_id):
+        self._windows.pop(job_id, None)
+        self._turns.pop(job_id, None)
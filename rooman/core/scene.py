@@ -0,0 +1,160 @@
+import asyncio
+import time
+
+from . import errors
+
+
+class SceneStep:
+    """
+    One action of a scene. Exactly one of `action_id` and `job_id` is given;
+    the step then calls `invoke_action` or `invoke_job_action` with
+    `parameter`. The step starts once all steps in `depends_on` succeeded.
+    """
+    def __init__(self, step_id, action_id=None, job_id=None, parameter=None,
+                 depends_on=()):
+        if (action_id is None) == (job_id is None):
+            raise ValueError(
+                'Step {}: exactly one of action_id and job_id is required'
+                .format(step_id))
+        self.step_id = step_id
+        self.action_id = action_id
+        self.job_id = job_id
+        self.parameter = parameter
+        self.depends_on = tuple(depends_on)
+
+    async def invoke(self, rooman):
+        if self.action_id is not None:
+            return await rooman.invoke_action(self.action_id, self.parameter)
+        return await rooman.invoke_job_action(self.job_id, self.parameter)
+
+
+class Scene:
+    def __init__(self, scene_id, steps, stop_on_failure=False):
+        self.scene_id = scene_id
+        self.steps = {}
+        for step in steps:
+            if step.step_id in self.steps:
+                raise ValueError('Duplicate step: {}'.format(step.step_id))
+            self.steps[step.step_id] = step
+        self.stop_on_failure = stop_on_failure
+
+        self.dependents = {step_id: [] for step_id in self.steps}
+        for step in self.steps.values():
+            for dependency in step.depends_on:
+                if dependency not in self.steps:
+                    raise ValueError('Step {} depends on unknown step {}'
+                                     .format(step.step_id, dependency))
+                self.dependents[dependency].append(step.step_id)
+        self._check_acyclic()
+
+    def _check_acyclic(self):
+        remaining = {k: len(v.depends_on) for k, v in self.steps.items()}
+        ready = [k for k, v in remaining.items() if v == 0]
+        visited = 0
+        while ready:
+            step_id = ready.pop()
+            visited += 1
+            for dependent in self.dependents[step_id]:
+                remaining[dependent] -= 1
+                if remaining[dependent] == 0:
+                    ready.append(dependent)
+        if visited != len(self.steps):
+            raise ValueError(
+                'Scene {} has a dependency cycle'.format(self.scene_id))
+
+    async def run(self, rooman):
+        """
+        Runs every step as soon as its dependencies succeeded, so independent
+        branches run concurrently. Steps depending on a failed step are
+        skipped. With `stop_on_failure`, the first failure also cancels
+        running steps and steps which have not started yet.
+        """
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        remaining = {k: len(v.depends_on) for k, v in self.steps.items()}
+        results = {k: {'status': 'pending', 'response': None, 'error': None,
+                       'start': None, 'duration': None}
+                   for k in self.steps}
+        running = {}
+
+        def start(step_id):
+            results[step_id]['status'] = 'running'
+            results[step_id]['start'] = loop.time() - started
+            task = loop.create_task(self._run_step(rooman, step_id))
+            running[task] = step_id
+
+        def skip(step_id):
+            results[step_id]['status'] = 'skipped'
+            for dependent in self.dependents[step_id]:
+                if results[dependent]['status'] == 'pending':
+                    skip(dependent)
+
+        for step_id, count in remaining.items():
+            if count == 0:
+                start(step_id)
+
+        failed = False
+        try:
+            while running:
+                done, _ = await asyncio.wait(
+                    running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    step_id = running.pop(task)
+                    result = results[step_id]
+                    response, error, duration = task.result()
+                    result['duration'] = duration
+                    if error is not None:
+                        failed = True
+                        result['status'] = 'failed'
+                        result['error'] = error
+                        for dependent in self.dependents[step_id]:
+                            skip(dependent)
+                        continue
+                    result['status'] = 'success'
+                    result['response'] = response
+                    for dependent in self.dependents[step_id]:
+                        remaining[dependent] -= 1
+                        if remaining[dependent] == 0:
+                            start(dependent)
+                if failed and self.stop_on_failure:
+                    break
+        finally:
+            for task, step_id in running.items():
+                task.cancel()
+                results[step_id]['status'] = 'cancelled'
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+
+        for result in results.values():
+            if result['status'] == 'pending':
+                result['status'] = 'cancelled'
+
+        return {
+            'scene_id': self.scene_id,
+            'success': not failed,
+            'duration': loop.time() - started,
+            'steps': results,
+        }
+
+    async def _run_step(self, rooman, step_id):
+        step = self.steps[step_id]
+        started = time.perf_counter()
+        with rooman.tracer.span('scene_step') as span:
+            span.set_attribute('scene_id', self.scene_id)
+            span.set_attribute('step_id', step_id)
+            try:
+                response = await step.invoke(rooman)
+            except Exception as e:
+                span.set_attribute('failed', True)
+                return None, _describe_error(e), time.perf_counter() - started
+        return response, None, time.perf_counter() - started
+
+
+def _describe_error(e):
+    if isinstance(e, errors.RuntimeRoomanError):
+        detail = e.detail
+    elif isinstance(e, errors.RoomanError) and hasattr(e, 'target'):
+        detail = {'target': e.target}
+    else:
+        detail = str(e)
+    return {'type': type(e).__name__, 'detail': detail}
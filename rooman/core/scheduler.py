@@ -0,0 +1,206 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+
+from . import errors
+from . import tracing
+
+
+logger = logging.getLogger(__name__)
+
+
+class Schedule:
+    def __init__(self, schedule_id, target, description, interval, jitter,
+                 job_id=None):
+        self.schedule_id = schedule_id
+        # The job the schedule acts on, if any. Its schedules are cancelled
+        # when the job is deleted.
+        self.job_id = job_id
+        self.target = target
+        self.description = description
+        self.interval = interval
+        self.jitter = jitter
+        # Time the schedule is due without jitter. Jitter is applied on top of
+        # this so that it does not accumulate over periodic runs.
+        self.base_time = None
+        self.next_run = None
+        self.running = False
+        self.cancelled = False
+        self.run_count = 0
+        self.skip_count = 0
+        self.last_error = None
+
+    def to_dict(self, now):
+        return {
+            'schedule_id': self.schedule_id,
+            'target': self.description,
+            'interval': self.interval,
+            'jitter': self.jitter,
+            'next_run_in': (max(self.next_run - now, 0)
+                            if self.next_run is not None else None),
+            'running': self.running,
+            'run_count': self.run_count,
+            'skip_count': self.skip_count,
+            'last_error': self.last_error,
+        }
+
+
+class Scheduler:
+    """
+    Runs one-shot and periodic coroutines from a single task.
+
+    All schedules are kept in one heap ordered by their next run time, so
+    the number of schedules does not affect the number of tasks waiting on
+    the event loop. A schedule never overlaps with itself; if it is still
+    running when it becomes due again, that run is skipped.
+    """
+    def __init__(self):
+        self._schedules = {}
+        # job_id -> set of schedule_id
+        self._job_schedules = {}
+        self._heap = []
+        self._ids = itertools.count(1)
+        self._sequence = itertools.count()
+        self._runs = set()
+        self._task = None
+        self._wakeup = None
+
+    def add(self, target, description=None, delay=0, interval=None, jitter=0,
+            job_id=None):
+        if delay < 0:
+            raise ValueError('delay must not be negative')
+        if interval is not None and interval <= 0:
+            raise ValueError('interval must be positive')
+        if jitter < 0:
+            raise ValueError('jitter must not be negative')
+
+        loop = asyncio.get_running_loop()
+        schedule_id = str(next(self._ids))
+        schedule = Schedule(schedule_id, target, description, interval, jitter,
+                            job_id)
+        schedule.base_time = loop.time() + delay
+        self._schedules[schedule_id] = schedule
+        if job_id is not None:
+            self._job_schedules.setdefault(job_id, set()).add(schedule_id)
+        self._push(schedule)
+        self._ensure_running(loop)
+        return schedule_id
+
+    def cancel(self, schedule_id):
+        schedule = self._schedules.get(schedule_id)
+        if schedule is None:
+            raise errors.ScheduleIDNotFoundError(schedule_id)
+        self._remove(schedule)
+        # The heap entry is left in place and dropped when it reaches the top.
+        schedule.cancelled = True
+        if len(self._heap) > 2 * len(self._schedules) + 64:
+            self._heap = [x for x in self._heap if not x[2].cancelled]
+            heapq.heapify(self._heap)
+
+    def cancel_job(self, job_id):
+        """
+        Cancels all schedules acting on the job `job_id`.
+        """
+        for schedule_id in list(self._job_schedules.get(job_id, ())):
+            self.cancel(schedule_id)
+
+    def list(self):
+        now = asyncio.get_running_loop().time()
+        return [x.to_dict(now) for x in self._schedules.values()]
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for run in list(self._runs):
+            run.cancel()
+        if self._runs:
+            await asyncio.gather(*self._runs, return_exceptions=True)
+
+    def _remove(self, schedule):
+        del self._schedules[schedule.schedule_id]
+        if schedule.job_id is not None:
+            schedule_ids = self._job_schedules[schedule.job_id]
+            schedule_ids.discard(schedule.schedule_id)
+            if not schedule_ids:
+                del self._job_schedules[schedule.job_id]
+
+    def _push(self, schedule):
+        schedule.next_run = schedule.base_time
+        if schedule.jitter:
+            schedule.next_run += random.uniform(0, schedule.jitter)
+        entry = (schedule.next_run, next(self._sequence), schedule)
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry and self._wakeup is not None:
+            self._wakeup.set()
+
+    def _ensure_running(self, loop):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        # Scheduled runs must not become part of the trace of the request
+        # that happened to start this task.
+        tracing.detach()
+        loop = asyncio.get_running_loop()
+        while True:
+            while self._heap and self._heap[0][2].cancelled:
+                heapq.heappop(self._heap)
+
+            handle = None
+            if self._heap:
+                now = loop.time()
+                when = self._heap[0][0]
+                if when <= now:
+                    _, _, schedule = heapq.heappop(self._heap)
+                    self._fire(schedule, loop, now)
+                    continue
+                handle = loop.call_at(when, self._wakeup.set)
+
+            self._wakeup.clear()
+            try:
+                await self._wakeup.wait()
+            finally:
+                if handle is not None:
+                    handle.cancel()
+
+    def _fire(self, schedule, loop, now):
+        if schedule.running:
+            schedule.skip_count += 1
+        else:
+            schedule.running = True
+            run = loop.create_task(self._invoke(schedule))
+            self._runs.add(run)
+            run.add_done_callback(self._runs.discard)
+
+        if schedule.interval is None:
+            schedule.next_run = None
+            return
+
+        schedule.base_time += schedule.interval
+        if schedule.base_time < now:
+            # Missed runs (e.g. the loop was blocked) are not caught up.
+            schedule.base_time = now + schedule.interval
+        self._push(schedule)
+
+    async def _invoke(self, schedule):
+        try:
+            await schedule.target()
+            schedule.last_error = None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            schedule.last_error = repr(e)
+            logger.exception('Schedule %s failed', schedule.schedule_id)
+        finally:
+            schedule.run_count += 1
+            schedule.running = False
+            if schedule.interval is None and not schedule.cancelled:
+                self._remove(schedule)
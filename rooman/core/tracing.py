@@ -0,0 +1,200 @@
+import asyncio
+import contextvars
+import json
+import logging
+import random
+import re
+import secrets
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+_current_span = contextvars.ContextVar('rooman_current_span', default=None)
+
+_trace_id_pattern = re.compile(r'[0-9A-Za-z_\-]{1,64}')
+
+
+class NullSpan:
+    """
+    Stands in for a span when the request is not traced. Every operation is
+    a no-op so callers never have to check whether tracing is enabled.
+    """
+    trace_id = None
+    span_id = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    def __init__(self, tracer, name, trace_id, parent_id):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = {}
+        self.error = None
+        self.start_time = None
+        self.duration = None
+        self._start_counter = None
+        self._token = None
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        self.start_time = time.time()
+        self._start_counter = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.duration = time.perf_counter() - self._start_counter
+        _current_span.reset(self._token)
+        if exc_value is not None:
+            self.error = repr(exc_value)
+        self.tracer._finish(self)
+        return False
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': self.start_time,
+            'duration': self.duration,
+            'attributes': self.attributes,
+            'error': self.error,
+        }
+
+
+class SpanSink:
+    def export(self, spans):
+        """
+        Receives a list of finished spans as dicts. Called in an executor,
+        so it may block.
+        """
+        raise NotImplementedError()
+
+
+class JSONLinesFileSink(SpanSink):
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        lines = ''.join(json.dumps(span, ensure_ascii=False) + '\n'
+                        for span in spans)
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(lines)
+
+
+class Tracer:
+    """
+    Records spans of sampled traces and hands them to `sink` in batches from
+    a background task.
+
+    Tracing is disabled while `sink` is `None` or `sample_rate` is 0; in
+    that case `start_trace` and `span` just return `NULL_SPAN`.
+    """
+    def __init__(self, sink=None, sample_rate=1.0, flush_interval=1.0,
+                 max_pending=10000):
+        self.sink = sink
+        self.sample_rate = sample_rate
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._pending = []
+        self._task = None
+
+    @property
+    def enabled(self):
+        return self.sink is not None and self.sample_rate > 0
+
+    def start_trace(self, name, trace_id=None):
+        """
+        Opens the root span of a new trace, or returns `NULL_SPAN` if this
+        trace is not sampled. `trace_id` is used as is when it is a valid
+        ID (e.g. one received from the client).
+        """
+        if not self.enabled:
+            return NULL_SPAN
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return NULL_SPAN
+        if not is_valid_trace_id(trace_id):
+            trace_id = secrets.token_hex(16)
+        return Span(self, name, trace_id, None)
+
+    def span(self, name):
+        """
+        Opens a child span of the current span. Returns `NULL_SPAN` when
+        there is no current span, i.e. outside of a sampled trace.
+        """
+        parent = _current_span.get()
+        if parent is None:
+            return NULL_SPAN
+        return Span(self, name, parent.trace_id, parent.span_id)
+
+    async def flush(self):
+        if not self._pending or self.sink is None:
+            return
+        spans, self._pending = self._pending, []
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self.sink.export, spans)
+        except Exception:
+            logger.exception('Failed to export %d spans', len(spans))
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def _finish(self, span):
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self._pending.append(span.to_dict())
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+
+def is_valid_trace_id(trace_id):
+    return (trace_id is not None and
+            _trace_id_pattern.fullmatch(trace_id) is not None)
+
+
+def current_span():
+    return _current_span.get() or NULL_SPAN
+
+
+def detach():
+    """
+    Makes the current context belong to no trace. Used by long-lived tasks
+    which would otherwise inherit the span active when they were created.
+    """
+    _current_span.set(None)
@@ -1,15 +1,81 @@
+import asyncio
+import functools
 import json
 
 from rooman import structured_query
 from rooman import core
+from rooman.core import tracing
+from . import compression
 from . import errors
 
 
 class RoomanAsyncWebInterface:
-    def __init__(self, rooman):
+    listjob_cache_size = 64
+    trace_id_header = b'x-trace-id'
+    introspection_max_top = 100
+
+    def __init__(self, rooman, compression_threshold=1024,
+                 compression_level=6,
+                 compression_encodings=('gzip', 'deflate'),
+                 compression_executor_threshold=64 * 1024,
+                 compression_executor=None, enable_introspection=False):
+        """
+        Response bodies of at least `compression_threshold` bytes are
+        compressed with the best of `compression_encodings` the client
+        accepts. `None` disables compression. Bodies of at least
+        `compression_executor_threshold` bytes are compressed in
+        `compression_executor` (the loop's default executor when `None`)
+        instead of on the event loop.
+
+        `/introspect`, which reports the memory used by jobs, is only served
+        when `enable_introspection` is true. `tracemalloc=true` on it adds a
+        `tracemalloc` diff against the previous such request (starting
+        `tracemalloc` on the first one) and `tracemalloc=false` stops it.
+        """
+        for encoding in compression_encodings:
+            if encoding not in compression.codecs:
+                raise ValueError(
+                    'Unsupported content-coding: {}'.format(encoding))
         self.rooman = rooman
-        
+        self.compression_threshold = compression_threshold
+        self.compression_level = compression_level
+        self.compression_encodings = tuple(compression_encodings)
+        self.compression_executor_threshold = compression_executor_threshold
+        self.compression_executor = compression_executor
+        self.enable_introspection = enable_introspection
+        # job_type_id (or None) -> (etag, body, compressed bodies by coding)
+        # of the latest version
+        self._listjob_cache = {}
+
+    async def compress(self, body, encoding):
+        codec = compression.codecs[encoding]
+        if len(body) < self.compression_executor_threshold:
+            return codec(body, self.compression_level)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.compression_executor,
+            functools.partial(codec, body, self.compression_level))
+
     async def asgi_handler(self, scope, receive, send):
+        trace_id = None
+        for k, v in scope.get('headers', ()):
+            if k.lower() == self.trace_id_header:
+                trace_id = v.decode('latin-1')
+                break
+        if not tracing.is_valid_trace_id(trace_id):
+            # Never echo arbitrary client input back in a header.
+            trace_id = None
+
+        with self.rooman.tracer.start_trace('request', trace_id) as span:
+            span.set_attribute('path', scope.get('path'))
+            span.set_attribute('method', scope.get('method'))
+            await self._handle_request(scope, receive, send, span,
+                                       span.trace_id or trace_id)
+
+    async def _handle_request(self, scope, receive, send, trace_span,
+                              trace_id):
+        tracer = self.rooman.tracer
+
         def try_get_key(query, key_name):
             try:
                 return True, query[key_name]
@@ -33,13 +99,66 @@ class RoomanAsyncWebInterface:
                 more_body = message.get('more_body', False)
             return body
 
-        async def respond(http_code, code, payload):
+        def get_header(name):
+            for k, v in scope.get('headers', ()):
+                if k.lower() == name:
+                    return v
+            return None
+
+        def variant_etag(etag, encoding):
+            # Each content-coding is a different representation and so needs
+            # its own entity tag.
+            if encoding is None:
+                return etag
+            return etag[:-1] + b'-' + encoding.encode('ascii') + b'"'
+
+        def etag_matches(etag):
+            if_none_match = get_header(b'if-none-match')
+            if if_none_match is None:
+                return None
+            candidates = (etag, variant_etag(etag, encoding))
+            for tag in if_none_match.split(b','):
+                tag = tag.strip()
+                if tag == b'*':
+                    return etag
+                if tag.startswith(b'W/'):
+                    tag = tag[2:]
+                if tag in candidates:
+                    return tag
+            return None
+
+        def encode_body(code, payload):
+            return json.dumps(
+                {'code': code, 'payload': payload},
+                ensure_ascii=False).encode('utf-8')
+
+        async def send_response(http_code, body, etag=None, compressed=None):
+            # `compressed` is a dict caching compressed variants of `body`.
             header = [
                 (b'Content-type', b'application/json; charset=utf-8'),
             ]
-            body = json.dumps(
-                {'code': code, 'payload': payload},
-                ensure_ascii=False).encode('utf-8')
+            if self.compression_threshold is not None:
+                header.append((b'Vary', b'Accept-Encoding'))
+                if (encoding is not None and body and
+                        len(body) >= self.compression_threshold):
+                    if compressed is not None and encoding in compressed:
+                        body = compressed[encoding]
+                    else:
+                        with tracer.span('compress') as span:
+                            span.set_attribute('encoding', encoding)
+                            span.set_attribute('size', len(body))
+                            body = await self.compress(body, encoding)
+                        if compressed is not None:
+                            compressed[encoding] = body
+                    header.append((b'Content-Encoding',
+                                   encoding.encode('ascii')))
+                    if etag is not None:
+                        etag = variant_etag(etag, encoding)
+            if etag is not None:
+                header.append((b'ETag', etag))
+            if trace_id is not None:
+                header.append((b'X-Trace-Id', trace_id.encode('latin-1')))
+            trace_span.set_attribute('status', http_code)
             await send({
                 'type': 'http.response.start',
                 'status': http_code,
@@ -50,15 +169,27 @@ class RoomanAsyncWebInterface:
                 'body': body
             })
 
+        async def respond(http_code, code, payload):
+            with tracer.span('encode'):
+                body = encode_body(code, payload)
+            await send_response(http_code, body)
+
         assert scope['type'] == 'http'
 
         path = scope['path']
+        encoding = None
+        if self.compression_threshold is not None:
+            encoding = compression.negotiate_encoding(
+                get_header(b'accept-encoding') or b'',
+                self.compression_encodings)
         
-        body = await read_body()
+        with tracer.span('read_body'):
+            body = await read_body()
         if body and not body.isspace():
             try:
-                body = body.decode('utf-8')
-                query = json.loads(body)
+                with tracer.span('json_decode'):
+                    body = body.decode('utf-8')
+                    query = json.loads(body)
             except UnicodeError:
                 await respond(400, 'invalid_body', 'encoding')
                 return
@@ -67,66 +198,142 @@ class RoomanAsyncWebInterface:
                 return
         else:
             query_string = scope['query_string']
-            query = structured_query.parse(query_string)
+            with tracer.span('parse_query'):
+                query = structured_query.parse(query_string)
 
         free_parameter_missing = False
         http_code, code, payload = None, None, None
+        response_body, response_etag, response_compressed = None, None, None
         try:
-            try:
-                if path == '/action':
-                    if scope['method'] != 'POST':
-                        raise errors.MethodNotAllowedAPIError()
-                    action_id = get_key(query, 'id', str)
-                    parameter_exists, parameter = try_get_key(query,
-                                                              'parameters')
-                    free_parameter_missing = not parameter_exists
-                    response = await self.rooman.invoke_action(action_id,
-                                                               parameter)
-                elif path == '/newjob':
-                    if scope['method'] != 'POST':
-                        raise errors.MethodNotAllowedAPIError()
-                    job_type_id = get_key(query, 'type_id', str)
-                    parameter_exists, parameter = try_get_key(query,
-                                                              'parameters')
-                    free_parameter_missing = not parameter_exists
-                    response = await self.rooman.new_job(job_type_id,
-                                                         parameter)
-                elif path == '/deletejob':
-                    if scope['method'] != 'POST':
-                        raise errors.MethodNotAllowedAPIError()
-                    job_id = get_key(query, 'id', str)
-                    response = await self.rooman.delete_job(job_id)
-                elif path == '/listjob':
-                    if scope['method'] != 'GET':
-                        raise errors.MethodNotAllowedAPIError()
-                    job_type_id = query.get('type_id')
-                    if not isinstance(job_type_id, str):
-                        job_type_id = None
-                    response = await self.rooman.list_job(job_type_id)
-                elif path == '/jobaction':
-                    if scope['method'] != 'POST':
-                        raise errors.MethodNotAllowedAPIError()
-                    job_id = get_key(query, 'id', str)
-                    parameter_exists, parameter = try_get_key(query,
-                                                              'parameters')
-                    free_parameter_missing = not parameter_exists
-                    response = await self.rooman.invoke_job_action(job_id,
-                                                                   parameter)
-                else:
-                    raise errors.PathNotFoundAPIError(path)
-
-            except core.errors.ActionIDNotFoundError as e:
-                raise errors.ActionIDNotFoundAPIError(e.target) from e
-            except core.errors.JobTypeIDNotFoundError as e:
-                raise errors.JobTypeIDNotFoundAPIError(e.target) from e
-            except core.errors.JobIDNotFoundError as e:
-                raise errors.JobIDNotFoundAPIError(e.target) from e
-            except core.errors.NewJobFreeParameterError as e:
-                raise errors.NewJobFreeParameterAPIError(e.errors) from e
-            except core.errors.JobActionFreeParameterError as e:
-                raise errors.JobActionFreeParameterAPIError(e.errors) from e
-            except core.errors.RuntimeRoomanError as e:
-                raise errors.RuntimeAPIError(e.detail) from e
+            with tracer.span('dispatch'):
+                try:
+                    if path == '/action':
+                        if scope['method'] != 'POST':
+                            raise errors.MethodNotAllowedAPIError()
+                        action_id = get_key(query, 'id', str)
+                        parameter_exists, parameter = try_get_key(
+                            query, 'parameters')
+                        free_parameter_missing = not parameter_exists
+                        response = await self.rooman.invoke_action(
+                            action_id, parameter)
+                    elif path == '/newjob':
+                        if scope['method'] != 'POST':
+                            raise errors.MethodNotAllowedAPIError()
+                        job_type_id = get_key(query, 'type_id', str)
+                        parameter_exists, parameter = try_get_key(
+                            query, 'parameters')
+                        free_parameter_missing = not parameter_exists
+                        response = await self.rooman.new_job(job_type_id,
+                                                             parameter)
+                    elif path == '/deletejob':
+                        if scope['method'] != 'POST':
+                            raise errors.MethodNotAllowedAPIError()
+                        job_id = get_key(query, 'id', str)
+                        response = await self.rooman.delete_job(job_id)
+                    elif path == '/listjob':
+                        if scope['method'] != 'GET':
+                            raise errors.MethodNotAllowedAPIError()
+                        job_type_id = query.get('type_id')
+                        if not isinstance(job_type_id, str):
+                            job_type_id = None
+                        etag = '"{}"'.format(
+                            self.rooman.get_job_list_version(job_type_id)
+                        ).encode('ascii')
+                        matched_etag = etag_matches(etag)
+                        if matched_etag is not None:
+                            # The body is empty, so no Content-Encoding is
+                            # added and the matched tag is sent back as is.
+                            await send_response(304, b'', matched_etag)
+                            return
+                        cached = self._listjob_cache.get(job_type_id)
+                        if cached is None or cached[0] != etag:
+                            response = await self.rooman.list_job(
+                                job_type_id)
+                            with tracer.span('encode'):
+                                cached = (etag,
+                                          encode_body('success', response), {})
+                            if (len(self._listjob_cache) >=
+                                    self.listjob_cache_size):
+                                self._listjob_cache.clear()
+                            self._listjob_cache[job_type_id] = cached
+                        response = None
+                        (response_etag, response_body,
+                         response_compressed) = cached
+                    elif path == '/jobaction':
+                        if scope['method'] != 'POST':
+                            raise errors.MethodNotAllowedAPIError()
+                        job_id = get_key(query, 'id', str)
+                        parameter_exists, parameter = try_get_key(
+                            query, 'parameters')
+                        free_parameter_missing = not parameter_exists
+                        response = await self.rooman.invoke_job_action(
+                            job_id, parameter)
+                    elif path == '/scene':
+                        if scope['method'] != 'POST':
+                            raise errors.MethodNotAllowedAPIError()
+                        scene_id = get_key(query, 'id', str)
+                        response = await self.rooman.invoke_scene(scene_id)
+                    elif path == '/introspect' and self.enable_introspection:
+                        if scope['method'] != 'GET':
+                            raise errors.MethodNotAllowedAPIError()
+                        # Values from the query string arrive as strings.
+                        top = query.get('top', 10)
+                        if isinstance(top, str):
+                            try:
+                                top = int(top)
+                            except ValueError:
+                                raise errors.ParameterFormatAPIError(['top'])
+                        if (not isinstance(top, int) or isinstance(top, bool)
+                                or not 0 <= top <= self.introspection_max_top):
+                            raise errors.ParameterFormatAPIError(['top'])
+                        # true: include a tracemalloc diff, false: stop
+                        # tracemalloc, missing: leave it as is.
+                        tracemalloc_diff = query.get('tracemalloc')
+                        if isinstance(tracemalloc_diff, str):
+                            tracemalloc_diff = {
+                                'true': True, 'false': False,
+                            }.get(tracemalloc_diff, tracemalloc_diff)
+                        if (tracemalloc_diff is not None and
+                                not isinstance(tracemalloc_diff, bool)):
+                            raise errors.ParameterFormatAPIError(
+                                ['tracemalloc'])
+                        response = await self.rooman.introspect_jobs(
+                            top, tracemalloc_diff)
+                    elif path == '/listschedule':
+                        if scope['method'] != 'GET':
+                            raise errors.MethodNotAllowedAPIError()
+                        response = await self.rooman.list_schedule()
+                    elif path == '/cancelschedule':
+                        if scope['method'] != 'POST':
+                            raise errors.MethodNotAllowedAPIError()
+                        schedule_id = get_key(query, 'id', str)
+                        response = await self.rooman.cancel_schedule(
+                            schedule_id)
+                    else:
+                        raise errors.PathNotFoundAPIError(path)
+
+                except core.errors.ActionIDNotFoundError as e:
+                    raise errors.ActionIDNotFoundAPIError(e.target) from e
+                except core.errors.JobTypeIDNotFoundError as e:
+                    raise errors.JobTypeIDNotFoundAPIError(e.target) from e
+                except core.errors.JobIDNotFoundError as e:
+                    raise errors.JobIDNotFoundAPIError(e.target) from e
+                except core.errors.SceneIDNotFoundError as e:
+                    raise errors.SceneIDNotFoundAPIError(e.target) from e
+                except core.errors.ScheduleIDNotFoundError as e:
+                    raise errors.ScheduleIDNotFoundAPIError(e.target) from e
+                except core.errors.SupersededError as e:
+                    raise errors.SupersededAPIError(e.target) from e
+                except core.errors.ThrottledError as e:
+                    raise errors.ThrottledAPIError(
+                        e.target, e.retry_after) from e
+                except core.errors.NewJobFreeParameterError as e:
+                    raise errors.NewJobFreeParameterAPIError(e.errors) from e
+                except core.errors.JobActionFreeParameterError as e:
+                    raise errors.JobActionFreeParameterAPIError(
+                        e.errors) from e
+                except core.errors.RuntimeRoomanError as e:
+                    raise errors.RuntimeAPIError(e.detail) from e
 
             http_code = 200
             code = 'success'
@@ -147,4 +354,8 @@ class RoomanAsyncWebInterface:
             code = e.get_code()
             payload = e.get_payload()
 
-        await respond(http_code, code, payload)
+        if response_body is not None and http_code == 200:
+            await send_response(http_code, response_body, response_etag,
+                                response_compressed)
+        else:
+            await respond(http_code, code, payload)
@@ -0,0 +1,53 @@
+import gzip
+import zlib
+
+
+def _gzip(data, level):
+    # `mtime=0` keeps the output deterministic for the same input.
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def _deflate(data, level):
+    return zlib.compress(data, level)
+
+
+# Content-coding name -> function(data, level) returning compressed bytes.
+# Order is the server preference when the client accepts several codings
+# with equal quality.
+codecs = {
+    'gzip': _gzip,
+    'deflate': _deflate,
+}
+
+
+def negotiate_encoding(accept_encoding, encodings):
+    """
+    Chooses a content-coding from `encodings` according to the value of an
+    `Accept-Encoding` header. Returns `None` when none is acceptable, in
+    which case the body should be sent as is.
+    """
+    if isinstance(accept_encoding, bytes):
+        accept_encoding = accept_encoding.decode('latin-1')
+
+    qualities = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name] = quality
+
+    best, best_quality = None, 0.0
+    for encoding in encodings:
+        quality = qualities.get(encoding, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
@@ -54,6 +54,67 @@ class JobIDNotFoundAPIError(APIError):
         return {'target': self.job_id}
 
 
+class ScheduleIDNotFoundAPIError(APIError):
+    def __init__(self, schedule_id):
+        self.schedule_id = schedule_id
+        super().__init__(schedule_id)
+
+    def get_http_status_code(self):
+        return 400
+
+    def get_code(self):
+        return 'scheduleid_notfound'
+
+    def get_payload(self):
+        return {'target': self.schedule_id}
+
+
+class SceneIDNotFoundAPIError(APIError):
+    def __init__(self, scene_id):
+        self.scene_id = scene_id
+        super().__init__(scene_id)
+
+    def get_http_status_code(self):
+        return 400
+
+    def get_code(self):
+        return 'sceneid_notfound'
+
+    def get_payload(self):
+        return {'target': self.scene_id}
+
+
+class SupersededAPIError(APIError):
+    def __init__(self, job_id):
+        self.job_id = job_id
+        super().__init__(job_id)
+
+    def get_http_status_code(self):
+        return 409
+
+    def get_code(self):
+        return 'superseded'
+
+    def get_payload(self):
+        return {'target': self.job_id}
+
+
+class ThrottledAPIError(APIError):
+    def __init__(self, job_id, retry_after):
+        self.job_id = job_id
+        self.retry_after = retry_after
+        super().__init__(job_id, retry_after)
+
+    def get_http_status_code(self):
+        return 429
+
+    def get_code(self):
+        return 'throttled'
+
+    def get_payload(self):
+        return {'target': self.job_id, 'retry_after': self.retry_after}
+
+
 class PathNotFoundAPIError(APIError):
     def __init__(self, path):
         self.path = path
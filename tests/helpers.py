@@ -0,0 +1,41 @@
+import asyncio
+
+from rooman.core import Job, RoomanBase, errors, tracing
+
+
+class CountingJob(Job):
+    def __init__(self):
+        self.actions = []
+
+    async def on_action(self, job_action_free_parameter):
+        self.actions.append(job_action_free_parameter)
+        return job_action_free_parameter
+
+
+class Rooman(RoomanBase):
+    def __init__(self):
+        super().__init__()
+        self.actions = []
+
+    async def do_action(self, action_id, action_free_parameter):
+        self.actions.append((action_id, action_free_parameter))
+
+    async def do_create_job(self, job_type_id, new_job_free_parameter):
+        return CountingJob()
+
+
+class ListSink(tracing.SpanSink):
+    def __init__(self):
+        self.spans = []
+
+    def export(self, spans):
+        self.spans.extend(spans)
+
+
+class SleepingRooman(Rooman):
+    async def do_action(self, action_id, action_free_parameter):
+        if action_id == 'fail':
+            raise errors.RuntimeRoomanError('broken')
+        await asyncio.sleep(action_free_parameter)
+        self.actions.append((action_id, action_free_parameter))
+        return action_id
@@ -0,0 +1,320 @@
+import asyncio
+import gzip
+import json
+import tracemalloc
+import unittest
+import zlib
+
+from rooman.core import DebouncePolicy, SceneStep, ThrottlePolicy
+from rooman.web_interface import RoomanAsyncWebInterface
+
+from tests.helpers import ListSink, Rooman, SleepingRooman
+
+
+class TestRoomanAsyncWebInterface(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.rooman = Rooman()
+        self.interface = RoomanAsyncWebInterface(self.rooman)
+
+    async def request(self, method, path, query=None, headers=(),
+                      query_string=b''):
+        body = json.dumps(query).encode('utf-8') if query is not None else b''
+        scope = {
+            'type': 'http',
+            'method': method,
+            'path': path,
+            'query_string': query_string,
+            'headers': list(headers),
+        }
+        messages = [{'type': 'http.request', 'body': body}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        await self.interface.asgi_handler(scope, receive, send)
+        start, body = sent
+        return start['status'], dict(start['headers']), body['body']
+
+
+class TestListJobETag(TestRoomanAsyncWebInterface):
+    async def test_not_modified(self):
+        await self.rooman.new_job('t', None)
+        status, headers, body = await self.request('GET', '/listjob')
+        self.assertEqual(status, 200)
+        self.assertEqual(len(json.loads(body)['payload']), 1)
+        etag = headers[b'ETag']
+
+        status, headers, body = await self.request(
+            'GET', '/listjob', headers=[(b'if-none-match', etag)])
+        self.assertEqual(status, 304)
+        self.assertEqual(body, b'')
+        self.assertEqual(headers[b'ETag'], etag)
+
+    async def test_changed(self):
+        job_id = await self.rooman.new_job('t', None)
+        _, headers, _ = await self.request('GET', '/listjob')
+        etag = headers[b'ETag']
+        await self.rooman.delete_job(job_id)
+
+        status, headers, body = await self.request(
+            'GET', '/listjob', headers=[(b'if-none-match', etag)])
+        self.assertEqual(status, 200)
+        self.assertNotEqual(headers[b'ETag'], etag)
+        self.assertEqual(json.loads(body)['payload'], [])
+
+    async def test_per_type_version(self):
+        await self.rooman.new_job('a', None)
+        _, headers, _ = await self.request(
+            'GET', '/listjob', {'type_id': 'a'})
+        etag = headers[b'ETag']
+        await self.rooman.new_job('b', None)
+
+        status, _, _ = await self.request(
+            'GET', '/listjob', {'type_id': 'a'},
+            headers=[(b'if-none-match', b'W/' + etag)])
+        self.assertEqual(status, 304)
+
+
+class TestSchedule(TestRoomanAsyncWebInterface):
+    async def asyncTearDown(self):
+        await self.rooman.close()
+
+    async def test_list_and_cancel(self):
+        schedule_id = await self.rooman.schedule_action('a', None,
+                                                        interval=10)
+        status, _, body = await self.request('GET', '/listschedule')
+        self.assertEqual(status, 200)
+        schedule, = json.loads(body)['payload']
+        self.assertEqual(schedule['schedule_id'], schedule_id)
+        self.assertEqual(schedule['target'], {'action_id': 'a'})
+
+        status, _, _ = await self.request('POST', '/cancelschedule',
+                                          {'id': schedule_id})
+        self.assertEqual(status, 200)
+        _, _, body = await self.request('GET', '/listschedule')
+        self.assertEqual(json.loads(body)['payload'], [])
+
+    async def test_cancel_unknown(self):
+        status, _, body = await self.request('POST', '/cancelschedule',
+                                             {'id': 'unknown'})
+        self.assertEqual(status, 400)
+        self.assertEqual(json.loads(body), {
+            'code': 'scheduleid_notfound', 'payload': {'target': 'unknown'}})
+
+
+class TestScene(TestRoomanAsyncWebInterface):
+    async def asyncSetUp(self):
+        self.rooman = SleepingRooman()
+        self.interface = RoomanAsyncWebInterface(self.rooman)
+
+    async def test_scene(self):
+        self.rooman.register_scene('evening', [
+            SceneStep('a', action_id='a', parameter=0),
+            SceneStep('b', action_id='b', parameter=0, depends_on=['a']),
+        ])
+        status, _, body = await self.request('POST', '/scene',
+                                             {'id': 'evening'})
+        self.assertEqual(status, 200)
+        payload = json.loads(body)['payload']
+        self.assertTrue(payload['success'])
+        self.assertEqual(payload['steps']['b']['response'], 'b')
+
+    async def test_unknown_scene(self):
+        status, _, body = await self.request('POST', '/scene',
+                                             {'id': 'unknown'})
+        self.assertEqual(status, 400)
+        self.assertEqual(json.loads(body), {
+            'code': 'sceneid_notfound', 'payload': {'target': 'unknown'}})
+
+
+class TestJobActionPolicy(TestRoomanAsyncWebInterface):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.job_id = await self.rooman.new_job('slider', None)
+
+    async def test_superseded(self):
+        self.rooman.set_job_action_policy('slider', DebouncePolicy(0.01))
+        (status0, _, body0), (status1, _, _) = await asyncio.gather(
+            self.request('POST', '/jobaction',
+                         {'id': self.job_id, 'parameters': 0}),
+            self.request('POST', '/jobaction',
+                         {'id': self.job_id, 'parameters': 1}))
+        self.assertEqual(status0, 409)
+        self.assertEqual(json.loads(body0), {
+            'code': 'superseded', 'payload': {'target': self.job_id}})
+        self.assertEqual(status1, 200)
+
+    async def test_throttled(self):
+        self.rooman.set_job_action_policy(
+            'slider', ThrottlePolicy(1, 10, reject=True))
+        query = {'id': self.job_id, 'parameters': 0}
+        status, _, _ = await self.request('POST', '/jobaction', query)
+        self.assertEqual(status, 200)
+        status, _, body = await self.request('POST', '/jobaction', query)
+        self.assertEqual(status, 429)
+        body = json.loads(body)
+        self.assertEqual(body['code'], 'throttled')
+        self.assertEqual(body['payload']['target'], self.job_id)
+        self.assertGreater(body['payload']['retry_after'], 0)
+
+
+class TestCompression(TestRoomanAsyncWebInterface):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.interface.compression_threshold = 100
+        for _ in range(20):
+            await self.rooman.new_job('t', None)
+
+    async def test_gzip(self):
+        status, headers, body = await self.request(
+            'GET', '/listjob', headers=[(b'accept-encoding', b'gzip, br')])
+        self.assertEqual(status, 200)
+        self.assertEqual(headers[b'Content-Encoding'], b'gzip')
+        self.assertEqual(headers[b'Vary'], b'Accept-Encoding')
+        self.assertEqual(len(json.loads(gzip.decompress(body))['payload']), 20)
+        etag = headers[b'ETag']
+
+        status, headers, _ = await self.request(
+            'GET', '/listjob', headers=[(b'accept-encoding', b'gzip'),
+                                        (b'if-none-match', etag)])
+        self.assertEqual(status, 304)
+        self.assertEqual(headers[b'ETag'], etag)
+
+    async def test_cached_variants(self):
+        _, headers, plain = await self.request('GET', '/listjob')
+        self.assertNotIn(b'Content-Encoding', headers)
+        _, headers, deflated = await self.request(
+            'GET', '/listjob',
+            headers=[(b'accept-encoding', b'gzip;q=0.5, deflate')])
+        self.assertEqual(headers[b'Content-Encoding'], b'deflate')
+        self.assertEqual(zlib.decompress(deflated), plain)
+        _, _, again = await self.request(
+            'GET', '/listjob', headers=[(b'accept-encoding', b'deflate')])
+        self.assertIs(again, deflated)
+
+    async def test_executor(self):
+        self.interface.compression_executor_threshold = 0
+        _, headers, body = await self.request(
+            'GET', '/listjob', headers=[(b'accept-encoding', b'*')])
+        self.assertEqual(headers[b'Content-Encoding'], b'gzip')
+        gzip.decompress(body)
+
+    async def test_small_body(self):
+        _, headers, _ = await self.request(
+            'POST', '/deletejob', {'id': 'unknown'},
+            headers=[(b'accept-encoding', b'gzip')])
+        self.assertNotIn(b'Content-Encoding', headers)
+
+    async def test_disabled(self):
+        self.interface.compression_threshold = None
+        _, headers, _ = await self.request(
+            'GET', '/listjob', headers=[(b'accept-encoding', b'gzip')])
+        self.assertNotIn(b'Content-Encoding', headers)
+        self.assertNotIn(b'Vary', headers)
+
+
+class TestTracing(TestRoomanAsyncWebInterface):
+    async def test_job_action_spans(self):
+        sink = ListSink()
+        self.rooman.tracer.sink = sink
+        job_id = await self.rooman.new_job('t', None)
+        _, headers, _ = await self.request(
+            'POST', '/jobaction', {'id': job_id, 'parameters': 1},
+            headers=[(b'x-trace-id', b'trace1')])
+        self.assertEqual(headers[b'X-Trace-Id'], b'trace1')
+        await self.rooman.tracer.close()
+
+        spans = {x['name']: x for x in sink.spans}
+        self.assertEqual(
+            set(spans),
+            {'request', 'read_body', 'json_decode', 'dispatch', 'on_action',
+             'encode'})
+        self.assertTrue(all(x['trace_id'] == 'trace1' for x in sink.spans))
+        self.assertEqual(spans['request']['attributes']['status'], 200)
+        self.assertEqual(spans['on_action']['parent_id'],
+                         spans['dispatch']['span_id'])
+
+    async def test_disabled(self):
+        _, headers, _ = await self.request('GET', '/listjob')
+        self.assertNotIn(b'X-Trace-Id', headers)
+
+    async def test_untraced_echo(self):
+        _, headers, _ = await self.request(
+            'GET', '/listjob', headers=[(b'x-trace-id', b'trace1')])
+        self.assertEqual(headers[b'X-Trace-Id'], b'trace1')
+        _, headers, _ = await self.request(
+            'GET', '/listjob', headers=[(b'x-trace-id', b'bad id\xff')])
+        self.assertNotIn(b'X-Trace-Id', headers)
+
+
+class TestIntrospection(TestRoomanAsyncWebInterface):
+    async def test_disabled_by_default(self):
+        status, _, _ = await self.request('GET', '/introspect')
+        self.assertEqual(status, 404)
+
+    async def test_enabled(self):
+        self.interface.enable_introspection = True
+        await self.rooman.new_job('t', None)
+        status, _, body = await self.request('GET', '/introspect',
+                                             {'top': 1})
+        self.assertEqual(status, 200)
+        payload = json.loads(body)['payload']
+        self.assertEqual(payload['job_types']['t']['count'], 1)
+        self.assertEqual(len(payload['largest_jobs']), 1)
+
+    async def test_invalid_top(self):
+        self.interface.enable_introspection = True
+        for top in (-1, 101, 'a', True):
+            status, _, body = await self.request('GET', '/introspect',
+                                                 {'top': top})
+            self.assertEqual(status, 400)
+            self.assertEqual(json.loads(body)['code'],
+                             'invalid_parameter_format')
+
+    async def test_query_string(self):
+        self.interface.enable_introspection = True
+        for _ in range(3):
+            await self.rooman.new_job('t', None)
+        status, _, body = await self.request('GET', '/introspect',
+                                             query_string=b'top=2')
+        self.assertEqual(status, 200)
+        self.assertEqual(len(json.loads(body)['payload']['largest_jobs']), 2)
+
+        for query_string in (b'top=-1', b'top=abc', b'top=101',
+                             b'tracemalloc=yes'):
+            status, _, _ = await self.request('GET', '/introspect',
+                                              query_string=query_string)
+            self.assertEqual(status, 400)
+
+        try:
+            status, _, body = await self.request(
+                'GET', '/introspect', query_string=b'tracemalloc=true')
+            self.assertEqual(status, 200)
+            self.assertEqual(json.loads(body)['payload']['tracemalloc'], [])
+            self.assertTrue(tracemalloc.is_tracing())
+            await self.request('GET', '/introspect',
+                               query_string=b'tracemalloc=false')
+            self.assertFalse(tracemalloc.is_tracing())
+        finally:
+            self.rooman.job_introspector.stop_tracemalloc()
+
+    async def test_tracemalloc(self):
+        self.interface.enable_introspection = True
+        try:
+            status, _, body = await self.request(
+                'GET', '/introspect', {'tracemalloc': True})
+            self.assertEqual(json.loads(body)['payload']['tracemalloc'], [])
+            self.assertTrue(tracemalloc.is_tracing())
+            await self.request('GET', '/introspect', {'tracemalloc': False})
+            self.assertFalse(tracemalloc.is_tracing())
+
+            for value in (1, [True]):
+                status, _, _ = await self.request(
+                    'GET', '/introspect', {'tracemalloc': value})
+                self.assertEqual(status, 400)
+        finally:
+            self.rooman.job_introspector.stop_tracemalloc()
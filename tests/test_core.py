@@ -0,0 +1,409 @@
+import asyncio
+import json
+import os
+import re
+import tempfile
+import tracemalloc
+import unittest
+
+from rooman.core import (
+    DebouncePolicy, Job, JobRecord, SceneStep, ThrottlePolicy, errors,
+    tracing)
+from rooman.core.introspection import JobIntrospector, approximate_size
+from rooman.core.job_id import (
+    MonotonicJobIDAllocator, UUIDJobIDAllocator)
+
+from tests.helpers import ListSink, Rooman, SleepingRooman
+
+
+class TestScheduler(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.rooman = Rooman()
+
+    async def asyncTearDown(self):
+        await self.rooman.close()
+
+    async def test_delayed_action(self):
+        await self.rooman.schedule_action('a', 1, delay=0.01)
+        self.assertEqual(self.rooman.actions, [])
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.rooman.actions, [('a', 1)])
+        self.assertEqual(await self.rooman.list_schedule(), [])
+
+    async def test_periodic_job_action(self):
+        job_id = await self.rooman.new_job('t', None)
+        schedule_id = await self.rooman.schedule_job_action(
+            job_id, 'x', interval=0.01)
+        await asyncio.sleep(0.055)
+        await self.rooman.cancel_schedule(schedule_id)
+        count = len(self.rooman.jobs[job_id].job.actions)
+        self.assertGreaterEqual(count, 3)
+        await asyncio.sleep(0.03)
+        self.assertEqual(len(self.rooman.jobs[job_id].job.actions), count)
+
+    async def test_no_overlap(self):
+        started = []
+
+        async def slow():
+            started.append(None)
+            await asyncio.sleep(0.05)
+
+        schedule_id = self.rooman.scheduler.add(slow, interval=0.01)
+        await asyncio.sleep(0.045)
+        self.assertEqual(len(started), 1)
+        schedule, = await self.rooman.list_schedule()
+        self.assertEqual(schedule['schedule_id'], schedule_id)
+        self.assertGreater(schedule['skip_count'], 0)
+
+    async def test_delete_job_cancels_schedules(self):
+        job_id = await self.rooman.new_job('t', None)
+        other_id = await self.rooman.new_job('t', None)
+        await self.rooman.schedule_job_action(job_id, 'x', interval=0.01)
+        await self.rooman.schedule_job_action(job_id, 'y', delay=10)
+        other_schedule_id = await self.rooman.schedule_job_action(
+            other_id, 'z', interval=0.01)
+        await self.rooman.delete_job(job_id)
+        schedule, = await self.rooman.list_schedule()
+        self.assertEqual(schedule['schedule_id'], other_schedule_id)
+        await asyncio.sleep(0.03)
+        schedule, = await self.rooman.list_schedule()
+        self.assertIsNone(schedule['last_error'])
+        self.assertEqual(self.rooman.scheduler._job_schedules,
+                         {other_id: {other_schedule_id}})
+
+    async def test_close(self):
+        sink = ListSink()
+        self.rooman.tracer.sink = sink
+        with self.rooman.tracer.start_trace('root'):
+            pass
+        await self.rooman.schedule_action('a', 1, interval=0.01)
+        await self.rooman.close()
+        self.assertEqual([x['name'] for x in sink.spans], ['root'])
+        await asyncio.sleep(0.03)
+        self.assertEqual(self.rooman.actions, [])
+
+    async def test_schedule_unknown_job(self):
+        with self.assertRaises(errors.JobIDNotFoundError):
+            await self.rooman.schedule_job_action('unknown', None,
+                                                  interval=0.01)
+        self.assertEqual(await self.rooman.list_schedule(), [])
+
+    async def test_cancel_unknown(self):
+        with self.assertRaises(errors.ScheduleIDNotFoundError):
+            await self.rooman.cancel_schedule('unknown')
+
+    async def test_many_schedules_single_task(self):
+        for i in range(2000):
+            await self.rooman.schedule_action('a', i, delay=0.01 + i * 1e-6)
+        before = len(asyncio.all_tasks())
+        await asyncio.sleep(0.05)
+        self.assertEqual(len(self.rooman.actions), 2000)
+        self.assertLessEqual(len(asyncio.all_tasks()), before)
+
+
+class TestTracing(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.sink = ListSink()
+        self.tracer = tracing.Tracer(self.sink)
+
+    async def asyncTearDown(self):
+        await self.tracer.close()
+
+    async def test_child_spans(self):
+        with self.tracer.start_trace('root', 'abc') as root:
+            with self.tracer.span('child') as child:
+                child.set_attribute('k', 'v')
+        await self.tracer.flush()
+        spans = {x['name']: x for x in self.sink.spans}
+        self.assertEqual(spans['root']['trace_id'], 'abc')
+        self.assertEqual(spans['child']['trace_id'], 'abc')
+        self.assertEqual(spans['child']['parent_id'], root.span_id)
+        self.assertEqual(spans['child']['attributes'], {'k': 'v'})
+
+    async def test_invalid_trace_id(self):
+        with self.tracer.start_trace('root', 'a b\n') as root:
+            pass
+        self.assertNotEqual(root.trace_id, 'a b\n')
+
+    async def test_disabled(self):
+        self.tracer.sample_rate = 0
+        self.assertIs(self.tracer.start_trace('root'), tracing.NULL_SPAN)
+        self.assertIs(self.tracer.span('child'), tracing.NULL_SPAN)
+
+    async def test_jsonlines_sink(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'spans.jsonl')
+            self.tracer.sink = tracing.JSONLinesFileSink(path)
+            with self.tracer.start_trace('root'):
+                with self.tracer.span('child'):
+                    pass
+            await self.tracer.flush()
+            with open(path, encoding='utf-8') as f:
+                names = [json.loads(line)['name'] for line in f]
+        self.assertEqual(names, ['child', 'root'])
+
+
+class TestScene(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.rooman = SleepingRooman()
+
+    async def test_parallel_branches(self):
+        self.rooman.register_scene('evening', [
+            SceneStep('a', action_id='a', parameter=0.05),
+            SceneStep('b', action_id='b', parameter=0.05),
+            SceneStep('c', action_id='c', parameter=0.01,
+                      depends_on=['a', 'b']),
+        ])
+        result = await self.rooman.invoke_scene('evening')
+        self.assertTrue(result['success'])
+        self.assertLess(result['duration'], 0.1)
+        self.assertEqual(self.rooman.actions[-1], ('c', 0.01))
+        self.assertEqual(result['steps']['c']['response'], 'c')
+        self.assertGreaterEqual(result['steps']['c']['start'], 0.05)
+
+    async def test_failure_skips_dependents(self):
+        self.rooman.register_scene('s', [
+            SceneStep('fail', action_id='fail'),
+            SceneStep('after', action_id='a', parameter=0,
+                      depends_on=['fail']),
+            SceneStep('other', action_id='b', parameter=0.01),
+        ])
+        result = await self.rooman.invoke_scene('s')
+        self.assertFalse(result['success'])
+        steps = result['steps']
+        self.assertEqual(steps['fail']['status'], 'failed')
+        self.assertEqual(steps['fail']['error'],
+                         {'type': 'RuntimeRoomanError', 'detail': 'broken'})
+        self.assertEqual(steps['after']['status'], 'skipped')
+        self.assertEqual(steps['other']['status'], 'success')
+
+    async def test_stop_on_failure(self):
+        self.rooman.register_scene('s', [
+            SceneStep('fail', action_id='fail'),
+            SceneStep('slow', action_id='a', parameter=1),
+            SceneStep('next', action_id='b', parameter=0,
+                      depends_on=['slow']),
+        ], stop_on_failure=True)
+        result = await self.rooman.invoke_scene('s')
+        steps = result['steps']
+        self.assertEqual(steps['slow']['status'], 'cancelled')
+        self.assertEqual(steps['next']['status'], 'cancelled')
+        self.assertEqual(self.rooman.actions, [])
+
+    async def test_invalid_graph(self):
+        with self.assertRaises(ValueError):
+            self.rooman.register_scene('s', [
+                SceneStep('a', action_id='a', depends_on=['b']),
+                SceneStep('b', action_id='b', depends_on=['a']),
+            ])
+        with self.assertRaises(ValueError):
+            self.rooman.register_scene('s', [
+                SceneStep('a', action_id='a', depends_on=['unknown']),
+            ])
+
+    async def test_unknown_scene(self):
+        with self.assertRaises(errors.SceneIDNotFoundError):
+            await self.rooman.invoke_scene('unknown')
+
+
+class BigJob(Job):
+    def __init__(self, size):
+        self.data = [bytes(100) for _ in range(size)]
+
+
+class TestIntrospection(unittest.IsolatedAsyncioTestCase):
+    async def test_report(self):
+        rooman = Rooman()
+        rooman.job_introspector.sample_size = 5
+        for _ in range(20):
+            await rooman.new_job('small', None)
+        job = BigJob(1000)
+        rooman.jobs['big'] = JobRecord('big', job)
+
+        report = await rooman.introspect_jobs(top=1)
+        self.assertEqual(report['job_count'], 21)
+        self.assertEqual(report['job_types']['small']['count'], 20)
+        self.assertEqual(report['job_types']['small']['sampled'], 5)
+        self.assertGreater(report['job_types']['big']['approximate_size'],
+                           100 * 1000)
+        largest, = report['largest_jobs']
+        self.assertEqual(largest['job_id'], 'big')
+        self.assertNotIn('tracemalloc', report)
+
+    async def test_largest_unsampled_job(self):
+        rooman = Rooman()
+        rooman.job_introspector.sample_size = 5
+        for i in range(200):
+            rooman.jobs['j{}'.format(i)] = JobRecord('t', BigJob(1))
+        rooman.jobs['big'] = JobRecord('t', BigJob(1000))
+
+        report = await rooman.introspect_jobs(top=2)
+        self.assertEqual(report['job_types']['t']['sampled'], 5)
+        self.assertEqual(report['largest_jobs'][0]['job_id'], 'big')
+        self.assertEqual(report['largest_jobs'][0]['job_type_id'], 't')
+
+    async def test_report_in_chunks(self):
+        rooman = Rooman()
+        rooman.job_introspector.chunk_size = 10
+        job_ids = [await rooman.new_job('t', None) for _ in range(50)]
+
+        async def delete_jobs():
+            for job_id in job_ids[25:]:
+                await rooman.delete_job(job_id)
+
+        report, _ = await asyncio.gather(rooman.introspect_jobs(),
+                                         delete_jobs())
+        self.assertLess(report['job_types']['t']['count'], 50)
+        self.assertGreaterEqual(report['job_types']['t']['count'], 25)
+
+    def test_approximate_size_excludes(self):
+        shared = [bytes(1000)]
+        job = BigJob(0)
+        job.shared = shared
+        self.assertGreater(approximate_size(job), 1000)
+        self.assertLess(approximate_size(job, exclude=[shared]), 1000)
+
+    async def test_tracemalloc_diff(self):
+        introspector = JobIntrospector()
+        try:
+            self.assertEqual(await introspector.tracemalloc_diff(), [])
+            retained = [bytearray(1000) for _ in range(1000)]
+            diff = await introspector.tracemalloc_diff(top=5)
+            self.assertTrue(any(x['size_diff'] > 0 for x in diff))
+            del retained
+        finally:
+            introspector.stop_tracemalloc()
+
+    async def test_tracemalloc_stop(self):
+        rooman = Rooman()
+        try:
+            report = await rooman.introspect_jobs(tracemalloc_diff=True)
+            self.assertEqual(report['tracemalloc'], [])
+            self.assertTrue(tracemalloc.is_tracing())
+            await rooman.introspect_jobs(tracemalloc_diff=False)
+            self.assertFalse(tracemalloc.is_tracing())
+        finally:
+            rooman.job_introspector.stop_tracemalloc()
+
+    async def test_tracemalloc_window(self):
+        introspector = JobIntrospector(tracemalloc_window=0.01)
+        try:
+            await introspector.tracemalloc_diff()
+            self.assertTrue(tracemalloc.is_tracing())
+            await asyncio.sleep(0.03)
+            self.assertFalse(tracemalloc.is_tracing())
+        finally:
+            introspector.stop_tracemalloc()
+
+
+class TestJobActionPolicy(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.rooman = Rooman()
+        self.job_id = await self.rooman.new_job('slider', None)
+        self.job = self.rooman.jobs[self.job_id].job
+
+    async def test_debounce(self):
+        self.rooman.set_job_action_policy('slider', DebouncePolicy(0.02))
+        results = await asyncio.gather(*(
+            self.rooman.invoke_job_action(self.job_id, i) for i in range(5)),
+            return_exceptions=True)
+        self.assertEqual(self.job.actions, [4])
+        self.assertEqual(results[4], 4)
+        self.assertTrue(all(isinstance(x, errors.SupersededError)
+                            for x in results[:4]))
+        self.assertEqual(self.rooman.job_action_policies['slider']._states,
+                         {})
+
+    async def test_throttle(self):
+        self.rooman.set_job_action_policy('slider', ThrottlePolicy(2, 0.05))
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await asyncio.gather(*(
+            self.rooman.invoke_job_action(self.job_id, i) for i in range(5)))
+        self.assertEqual(self.job.actions, [0, 1, 2, 3, 4])
+        self.assertGreaterEqual(loop.time() - started, 0.1)
+
+    async def test_throttle_cancelled_waiter(self):
+        self.rooman.set_job_action_policy('slider', ThrottlePolicy(1, 0.1))
+        loop = asyncio.get_running_loop()
+        await self.rooman.invoke_job_action(self.job_id, 0)
+        waiter = asyncio.ensure_future(
+            self.rooman.invoke_job_action(self.job_id, 1))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+        started = loop.time()
+        await self.rooman.invoke_job_action(self.job_id, 2)
+        self.assertLess(loop.time() - started, 0.15)
+        self.assertEqual(self.job.actions, [0, 2])
+
+    async def test_debounce_delete_job(self):
+        self.rooman.set_job_action_policy('slider', DebouncePolicy(0.02))
+        waiter = asyncio.ensure_future(
+            self.rooman.invoke_job_action(self.job_id, 'after-delete'))
+        await asyncio.sleep(0)
+        await self.rooman.delete_job(self.job_id)
+        with self.assertRaises(errors.JobIDNotFoundError):
+            await waiter
+        self.assertEqual(self.job.actions, [])
+
+    async def test_throttle_delete_job(self):
+        self.rooman.set_job_action_policy('slider', ThrottlePolicy(1, 0.02))
+        await self.rooman.invoke_job_action(self.job_id, 0)
+        waiter = asyncio.ensure_future(
+            self.rooman.invoke_job_action(self.job_id, 'after-delete'))
+        await asyncio.sleep(0)
+        await self.rooman.delete_job(self.job_id)
+        with self.assertRaises(errors.JobIDNotFoundError):
+            await waiter
+        self.assertEqual(self.job.actions, [0])
+
+    async def test_throttle_reject(self):
+        self.rooman.set_job_action_policy(
+            'slider', ThrottlePolicy(1, 10, reject=True))
+        await self.rooman.invoke_job_action(self.job_id, 0)
+        with self.assertRaises(errors.ThrottledError):
+            await self.rooman.invoke_job_action(self.job_id, 1)
+        await self.rooman.delete_job(self.job_id)
+        self.assertEqual(
+            self.rooman.job_action_policies['slider']._windows, {})
+
+
+class TestJobRecord(unittest.IsolatedAsyncioTestCase):
+    async def test_new_job(self):
+        rooman = Rooman()
+        job_ids = [await rooman.new_job(''.join(['t', 'ype']), None)
+                   for _ in range(3)]
+        self.assertEqual(len(set(job_ids)), 3)
+        self.assertTrue(all(re.fullmatch(r'[0-9A-Za-z_\-]+', x)
+                            for x in job_ids))
+        first, second = (rooman.jobs[x] for x in job_ids[:2])
+        self.assertIs(first.job_type_id, second.job_type_id)
+        self.assertFalse(hasattr(first, '__dict__'))
+
+        job_type_id, job = first
+        self.assertEqual(job_type_id, 'type')
+        self.assertIs(rooman.jobs[job_ids[0]][1], job)
+
+    async def test_last_used(self):
+        rooman = Rooman()
+        job_id = await rooman.new_job('t', None)
+        record = rooman.jobs[job_id]
+        record.last_used = 0
+        await rooman.invoke_job_action(job_id, None)
+        self.assertGreaterEqual(record.last_used, record.created_at)
+
+    def test_monotonic_allocator(self):
+        allocator = MonotonicJobIDAllocator('p')
+        job_ids = [allocator.allocate() for _ in range(300)]
+        self.assertEqual(job_ids[14:17], ['p0f', 'p110', 'p111'])
+        self.assertEqual(job_ids, sorted(job_ids))
+        self.assertNotEqual(MonotonicJobIDAllocator().prefix,
+                            MonotonicJobIDAllocator().prefix)
+
+    async def test_custom_allocator(self):
+        rooman = Rooman()
+        rooman.job_id_allocator = UUIDJobIDAllocator()
+        job_id = await rooman.new_job('t', None)
+        self.assertEqual(len(job_id), 36)